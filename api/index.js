@@ -4,17 +4,90 @@ const database = require('../config/database');
 const Trade = require('../models/Trade');
 require('dotenv').config();
 
+// Number of tickers listed per page by /profit and /trades; keeps replies
+// well under Telegram's 4096 character message limit
+const PAGE_SIZE = 25;
+
+// Highest page number that is queried; anything above is reported as empty
+// rather than sent to the database as an out-of-range skip
+const MAX_PAGE = 10000;
+
+// Webhook acknowledgements never change, so encode them once
+const WEBHOOK_OK_BODY = JSON.stringify({ status: 'OK' });
+const WEBHOOK_ERROR_BODY = JSON.stringify({ status: 'Error but OK' });
+const WEBHOOK_UNAVAILABLE_BODY = JSON.stringify({ status: 'Not ready' });
+
+// Maps each command to the TelegramBotHandler method that serves it
+const COMMAND_HANDLERS = Object.freeze({
+  '/start': 'handleStartCommand',
+  '/buy': 'handleBuyCommand',
+  '/sell': 'handleSellCommand',
+  '/profit': 'handleProfitCommand',
+  '/trades': 'handleTradesCommand',
+  '/cleanup': 'handleCleanupCommand'
+});
+
+// Telegram updates are a few KB at most; bound the body we will buffer
+const parseUpdate = express.json({ limit: '100kb' });
+
 const app = express();
-app.use(express.json());
+
+// Per-ticker section of the /profit summary
+function formatProfitRow(trade) {
+  // Lean results skip schema defaults, so fill in unset sold totals
+  const soldValue = trade.total_sold_value ?? 0;
+  const sharesSold = trade.total_shares_sold ?? 0;
+  const profit = soldValue - (sharesSold * trade.average_buy_price);
+  const emoji = profit >= 0 ? '✅' : '❌';
+  const remainingShares = (trade.total_shares - sharesSold).toFixed(6);
+  
+  return `${emoji} **${trade.ticker}**\n` +
+    `Invested: $${trade.total_invested.toFixed(2)}\n` +
+    `Sold: $${soldValue.toFixed(2)} (${sharesSold.toFixed(6)} shares)\n` +
+    `Remaining: ${remainingShares} shares @ $${trade.average_buy_price.toFixed(2)} avg\n` +
+    `Profit: $${profit.toFixed(2)}\n\n`;
+}
+
+// Per-ticker section of the /trades holdings list
+function formatHoldingRow(trade) {
+  const remainingShares = trade.total_shares - (trade.total_shares_sold ?? 0);
+  const currentValue = (remainingShares * trade.average_buy_price).toFixed(2);
+  const firstBuyDate = new Date(trade.first_buy_date).toLocaleDateString();
+  const lastBought = trade.last_buy_date !== trade.first_buy_date
+    ? `Last bought: ${new Date(trade.last_buy_date).toLocaleDateString()}\n`
+    : '';
+  
+  return `🔹 **${trade.ticker}**\n` +
+    `Shares: ${remainingShares.toFixed(6)} @ $${trade.average_buy_price.toFixed(2)} avg\n` +
+    `Invested: $${trade.total_invested.toFixed(2)}\n` +
+    `Current Value: $${currentValue}\n` +
+    `First bought: ${firstBuyDate}\n` +
+    `${lastBought}\n`;
+}
 
 // Telegram Bot Handler Class
 class TelegramBotHandler {
   constructor() {
     this.bot = null;
     this.isInitialized = false;
+    this.initPromise = null;
   }
 
-  async init() {
+  // Safe to call repeatedly: warm invocations return immediately and
+  // concurrent callers share the in-flight initialization.
+  init() {
+    if (this.isInitialized) {
+      return Promise.resolve();
+    }
+    if (!this.initPromise) {
+      this.initPromise = this.createBot().finally(() => {
+        this.initPromise = null;
+      });
+    }
+    return this.initPromise;
+  }
+
+  async createBot() {
     try {
       const token = process.env.TELEGRAM_BOT_TOKEN;
       if (!token) {
@@ -36,30 +109,15 @@ class TelegramBotHandler {
   }
 
   // Method to handle webhook updates
+  // The webhook route only passes slash-command messages, after the bot and
+  // database are initialized.
   async handleWebhookUpdate(update) {
     try {
-      console.log('=== WEBHOOK UPDATE RECEIVED ===');
-      console.log('Update:', JSON.stringify(update, null, 2));
+      const msg = update.message;
+      console.log('=== WEBHOOK UPDATE RECEIVED ===', update.update_id);
+      console.log('Processing message:', msg.text);
       
-      // Ensure bot is initialized
-      if (!this.bot) {
-        console.log('Bot not initialized, attempting to initialize...');
-        await this.init();
-      }
-      
-      if (update.message && update.message.text) {
-        const msg = update.message;
-        console.log('Processing message:', msg.text);
-        
-        // Handle commands
-        if (msg.text.startsWith('/')) {
-          await this.handleCommand(msg);
-        } else {
-          console.log('Non-command message ignored:', msg.text);
-        }
-      } else {
-        console.log('No text message in update');
-      }
+      await this.handleCommand(msg);
     } catch (error) {
       console.error('Error handling webhook update:', error);
     }
@@ -69,28 +127,8 @@ class TelegramBotHandler {
     const text = msg.text;
     const command = text.split(' ')[0];
     
-    switch (command) {
-      case '/start':
-        await this.handleStartCommand(msg);
-        break;
-      case '/buy':
-        await this.handleBuyCommand(msg);
-        break;
-      case '/sell':
-        await this.handleSellCommand(msg);
-        break;
-      case '/profit':
-        await this.handleProfitCommand(msg);
-        break;
-      case '/trades':
-        await this.handleTradesCommand(msg);
-        break;
-      case '/cleanup':
-        await this.handleCleanupCommand(msg);
-        break;
-      default:
-        await this.handleUnknownCommand(msg);
-    }
+    const handlerName = COMMAND_HANDLERS[command] || 'handleUnknownCommand';
+    await this[handlerName](msg);
   }
 
   setupErrorHandling() {
@@ -113,8 +151,8 @@ class TelegramBotHandler {
 Available commands:
 • /buy {ticker} {price} [dollar_amount] - Record a buy trade
 • /sell {ticker} {price} [dollar_amount] - Record a sell trade
-• /profit - View profit summary
-• /trades - View open trades
+• /profit [page] - View profit summary
+• /trades [page] - View open trades
 • /cleanup - Remove corrupted trade data
 
 Examples:
@@ -168,86 +206,8 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
         return;
       }
       
-      // Check if trade exists first
-      let trade = await Trade.findOne({ ticker: ticker.toUpperCase() });
-      
-      if (!trade) {
-        // Create new trade
-        trade = new Trade({
-          ticker: ticker.toUpperCase(),
-          average_buy_price: price,
-          total_shares: newShares,
-          total_invested: quantity,
-          total_sold_value: 0,
-          total_shares_sold: 0,
-          first_buy_date: new Date(),
-          last_buy_date: new Date(),
-          last_sell_date: null
-        });
-      } else {
-        // Debug logging for existing trade
-        console.log('Existing trade data:', { 
-          ticker: trade.ticker, 
-          total_shares: trade.total_shares, 
-          total_invested: trade.total_invested,
-          average_buy_price: trade.average_buy_price
-        });
-        
-        // Check if existing trade data is corrupted (undefined values)
-        if (trade.total_shares === undefined || trade.total_invested === undefined || 
-            trade.average_buy_price === undefined) {
-          console.log('Corrupted trade data detected, treating as new trade');
-          // Treat this as a new trade by overwriting the corrupted data
-          trade.average_buy_price = price;
-          trade.total_shares = newShares;
-          trade.total_invested = quantity;
-          trade.total_sold_value = 0;
-          trade.total_shares_sold = 0;
-          trade.first_buy_date = new Date();
-          trade.last_buy_date = new Date();
-          trade.last_sell_date = null;
-        } else {
-          // Validate existing trade data
-          if (isNaN(trade.total_shares) || isNaN(trade.total_invested) || 
-              trade.total_shares < 0 || trade.total_invested < 0) {
-            throw new Error('Invalid existing trade data: corrupted values detected');
-          }
-          
-          // Update existing trade - calculate new average price
-          const totalNewShares = trade.total_shares + newShares;
-          const totalNewInvested = trade.total_invested + quantity;
-          
-          // Debug logging for calculations
-          console.log('Calculation values:', { 
-            totalNewShares, 
-            totalNewInvested, 
-            newShares, 
-            quantity 
-          });
-          
-          // Ensure we don't have division by zero or invalid values
-          if (totalNewShares <= 0 || isNaN(totalNewShares) || isNaN(totalNewInvested)) {
-            throw new Error('Invalid calculation: total shares or invested amount is invalid');
-          }
-          
-          const newAveragePrice = totalNewInvested / totalNewShares;
-          
-          // Debug logging for final calculation
-          console.log('Final calculation:', { newAveragePrice });
-          
-          // Validate the calculated values before saving
-          if (isNaN(newAveragePrice) || newAveragePrice <= 0) {
-            throw new Error('Invalid calculation: average price is invalid');
-          }
-          
-          trade.average_buy_price = newAveragePrice;
-          trade.total_shares = totalNewShares;
-          trade.total_invested = totalNewInvested;
-          trade.last_buy_date = new Date();
-        }
-      }
-      
-      await trade.save();
+      // Create or update the trade in one round trip
+      const trade = await Trade.recordBuy(ticker, price, quantity, newShares);
       
       await this.bot.sendMessage(chatId, 
         `✅ Bought $${quantity.toFixed(2)} worth of ${ticker} at $${price.toFixed(2)} per share\n` +
@@ -287,29 +247,21 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
     }
     
     try {
-      // Get trade for this ticker
-      const trade = await Trade.findOne({ ticker: ticker.toUpperCase() });
+      // Sell a specific dollar amount, or all remaining shares
+      const sharesRequested = sellDollarAmount ? sellDollarAmount / sellPrice : null;
       
-      if (!trade || trade.total_shares === 0) {
-        await this.bot.sendMessage(chatId, `No holdings found for ${ticker}.`);
-        return;
-      }
+      // Find and update in one round trip; returns the trade before the sale
+      const trade = await Trade.sellShares(ticker, sellPrice, sharesRequested);
       
-      // Calculate remaining shares manually
-      const remainingShares = trade.total_shares - trade.total_shares_sold;
-      
-      // Calculate how many shares to sell
-      let sharesToSell;
-      if (!sellDollarAmount) {
-        // Sell all remaining shares
-        sharesToSell = remainingShares;
-      } else {
-        // Sell specific dollar amount
-        sharesToSell = sellDollarAmount / sellPrice;
-      }
-      
-      // Check if we have enough shares
-      if (sharesToSell > remainingShares) {
+      if (!trade) {
+        const existing = await Trade.findOne({ ticker }).lean();
+        
+        if (!existing || !(existing.total_shares > 0)) {
+          await this.bot.sendMessage(chatId, `No holdings found for ${ticker}.`);
+          return;
+        }
+        
+        const remainingShares = existing.total_shares - (existing.total_shares_sold ?? 0);
         const maxDollarAmount = (remainingShares * sellPrice).toFixed(2);
         await this.bot.sendMessage(chatId, 
           `⚠️ You only have ${remainingShares.toFixed(6)} shares of ${ticker}.\n` +
@@ -318,21 +270,22 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
         return;
       }
       
-      // Update trade with sell information
+      // Calculate remaining shares manually
+      const sharesSold = trade.total_shares_sold ?? 0;
+      const remainingShares = trade.total_shares - sharesSold;
+      const sharesToSell = sharesRequested === null ? remainingShares : sharesRequested;
+      
       const sellValue = sharesToSell * sellPrice;
       const profitPerShare = sellPrice - trade.average_buy_price;
       const totalProfit = profitPerShare * sharesToSell;
       const profitPercent = ((profitPerShare / trade.average_buy_price) * 100).toFixed(2);
       
-      trade.total_shares_sold += sharesToSell;
-      trade.total_sold_value += sellValue;
-      trade.last_sell_date = new Date();
-      
-      await trade.save();
+      const totalSharesSold = sharesSold + sharesToSell;
+      const totalSoldValue = (trade.total_sold_value ?? 0) + sellValue;
       
       const profitEmoji = totalProfit >= 0 ? '📈' : '📉';
       const newRemainingShares = remainingShares - sharesToSell;
-      const totalProfitOnTicker = trade.total_sold_value - (trade.total_shares_sold * trade.average_buy_price);
+      const totalProfitOnTicker = totalSoldValue - (totalSharesSold * trade.average_buy_price);
       
       await this.bot.sendMessage(chatId, 
         `${profitEmoji} Sold ${sharesToSell.toFixed(6)} shares of ${ticker} at $${sellPrice.toFixed(2)} per share\n` +
@@ -342,7 +295,7 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
         `Total profit on ${ticker}: $${totalProfitOnTicker.toFixed(2)}`
       );
       
-      console.log('Trade updated:', trade);
+      console.log('Trade updated:', { ticker, total_shares_sold: totalSharesSold, total_sold_value: totalSoldValue });
     } catch (error) {
       const dollarText = sellDollarAmount ? ` $${sellDollarAmount.toFixed(2)} worth of` : '';
       await this.bot.sendMessage(chatId, `⚠️ Database error. Cannot process sell command.\n\n✅ Would have sold${dollarText} ${ticker} at $${sellPrice.toFixed(2)}`);
@@ -352,42 +305,47 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
 
   async handleProfitCommand(msg) {
     const chatId = msg.chat.id;
+    const page = this.getPageNumber(msg);
+    const skip = (page - 1) * PAGE_SIZE;
+    
+    if (page > MAX_PAGE) {
+      await this.bot.sendMessage(chatId, `No trades on page ${page}.`);
+      return;
+    }
     
     try {
-      const allTrades = await Trade.getAllTrades();
+      const [totals, allTrades] = await Promise.all([
+        Trade.getProfitTotals(),
+        Trade.getAllTrades({ skip, limit: PAGE_SIZE })
+      ]);
       
-      if (allTrades.length === 0) {
+      if (totals.count === 0) {
         await this.bot.sendMessage(chatId, 'No trades found.');
         return;
       }
       
-      let message = '📊 **Trading Summary**\n\n';
-      let totalProfit = 0;
-      let totalInvested = 0;
-      let totalSoldValue = 0;
+      if (allTrades.length === 0) {
+        await this.bot.sendMessage(chatId, `No trades on page ${page}.`);
+        return;
+      }
       
-      allTrades.forEach(trade => {
-        const profit = trade.total_profit;
-        const emoji = profit >= 0 ? '✅' : '❌';
-        const remainingShares = trade.remaining_shares.toFixed(6);
-        
-        message += `${emoji} **${trade.ticker}**\n`;
-        message += `Invested: $${trade.total_invested.toFixed(2)}\n`;
-        message += `Sold: $${trade.total_sold_value.toFixed(2)} (${trade.total_shares_sold.toFixed(6)} shares)\n`;
-        message += `Remaining: ${remainingShares} shares @ $${trade.average_buy_price.toFixed(2)} avg\n`;
-        message += `Profit: $${profit.toFixed(2)}\n\n`;
-        
-        totalProfit += profit;
-        totalInvested += trade.total_invested;
-        totalSoldValue += trade.total_sold_value;
-      });
+      const parts = ['📊 **Trading Summary**\n\n'];
+      
+      allTrades.forEach(trade => parts.push(formatProfitRow(trade)));
       
-      const totalEmoji = totalProfit >= 0 ? '🎉' : '😞';
-      message += `${totalEmoji} **Total Summary**\n`;
-      message += `Total Invested: $${totalInvested.toFixed(2)}\n`;
-      message += `Total Sold: $${totalSoldValue.toFixed(2)}\n`;
-      message += `Total Profit: $${totalProfit.toFixed(2)}`;
+      if (totals.count > skip + allTrades.length) {
+        parts.push(`Page ${page} of ${Math.ceil(totals.count / PAGE_SIZE)} - send /profit ${page + 1} for more\n\n`);
+      }
+      
+      const totalEmoji = totals.total_profit >= 0 ? '🎉' : '😞';
+      parts.push(
+        `${totalEmoji} **Total Summary**\n` +
+        `Total Invested: $${totals.total_invested.toFixed(2)}\n` +
+        `Total Sold: $${totals.total_sold_value.toFixed(2)}\n` +
+        `Total Profit: $${totals.total_profit.toFixed(2)}`
+      );
       
+      const message = parts.join('');
       await this.bot.sendMessage(chatId, message, { parse_mode: 'Markdown' });
     } catch (error) {
       await this.bot.sendMessage(chatId, '⚠️ Database error. Cannot retrieve profit data.');
@@ -397,40 +355,36 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
 
   async handleTradesCommand(msg) {
     const chatId = msg.chat.id;
+    const page = this.getPageNumber(msg);
+    
+    if (page > MAX_PAGE) {
+      await this.bot.sendMessage(chatId, `No active holdings on page ${page}.`);
+      return;
+    }
     
     try {
-      const allTrades = await Trade.getAllTrades();
-      
-      // Filter trades that have remaining shares (calculate manually)
-      const activeTrades = allTrades.filter(trade => {
-        const remainingShares = trade.total_shares - trade.total_shares_sold;
-        return remainingShares > 0;
-      });
+      // Fetch one extra row to learn whether another page follows
+      const activeTrades = await Trade.getOpenTrades({ skip: (page - 1) * PAGE_SIZE, limit: PAGE_SIZE + 1 });
+      const hasMore = activeTrades.length > PAGE_SIZE;
+      if (hasMore) {
+        activeTrades.pop();
+      }
       
       if (activeTrades.length === 0) {
-        await this.bot.sendMessage(chatId, 'No active holdings found.');
+        const emptyMessage = page > 1 ? `No active holdings on page ${page}.` : 'No active holdings found.';
+        await this.bot.sendMessage(chatId, emptyMessage);
         return;
       }
       
-      let message = '📋 **Current Holdings**\n\n';
+      const parts = ['📋 **Current Holdings**\n\n'];
       
-      activeTrades.forEach(trade => {
-        const remainingShares = trade.total_shares - trade.total_shares_sold;
-        const currentValue = (remainingShares * trade.average_buy_price).toFixed(2);
-        const firstBuyDate = new Date(trade.first_buy_date).toLocaleDateString();
-        const lastBuyDate = new Date(trade.last_buy_date).toLocaleDateString();
-        
-        message += `🔹 **${trade.ticker}**\n`;
-        message += `Shares: ${remainingShares.toFixed(6)} @ $${trade.average_buy_price.toFixed(2)} avg\n`;
-        message += `Invested: $${trade.total_invested.toFixed(2)}\n`;
-        message += `Current Value: $${currentValue}\n`;
-        message += `First bought: ${firstBuyDate}\n`;
-        if (trade.last_buy_date !== trade.first_buy_date) {
-          message += `Last bought: ${lastBuyDate}\n`;
-        }
-        message += '\n';
-      });
+      activeTrades.forEach(trade => parts.push(formatHoldingRow(trade)));
       
+      if (hasMore) {
+        parts.push(`Send /trades ${page + 1} for more`);
+      }
+      
+      const message = parts.join('');
       await this.bot.sendMessage(chatId, message, { parse_mode: 'Markdown' });
     } catch (error) {
       await this.bot.sendMessage(chatId, '⚠️ Database error. Cannot retrieve trades data.');
@@ -438,21 +392,18 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
     }
   }
 
+  // Page number from the first command argument, e.g. "/trades 2"
+  getPageNumber(msg) {
+    const page = parseInt(msg.text.split(' ')[1], 10);
+    return page > 0 ? page : 1;
+  }
+
   async handleCleanupCommand(msg) {
     const chatId = msg.chat.id;
     
     try {
       // Find all trades with undefined or invalid values
-      const corruptedTrades = await Trade.find({
-        $or: [
-          { total_shares: { $exists: false } },
-          { total_invested: { $exists: false } },
-          { average_buy_price: { $exists: false } },
-          { total_shares: null },
-          { total_invested: null },
-          { average_buy_price: null }
-        ]
-      });
+      const corruptedTrades = await Trade.findCorruptedTrades();
       
       if (corruptedTrades.length === 0) {
         await this.bot.sendMessage(chatId, '✅ No corrupted trades found. Database is clean!');
@@ -460,16 +411,7 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
       }
       
       // Delete corrupted trades
-      const result = await Trade.deleteMany({
-        $or: [
-          { total_shares: { $exists: false } },
-          { total_invested: { $exists: false } },
-          { average_buy_price: { $exists: false } },
-          { total_shares: null },
-          { total_invested: null },
-          { average_buy_price: null }
-        ]
-      });
+      const result = await Trade.deleteCorruptedTrades();
       
       await this.bot.sendMessage(chatId, 
         `🧹 Cleanup completed!\n` +
@@ -494,19 +436,35 @@ Note: Dollar amount is optional (defaults to 1 share worth)`;
 const telegramBot = new TelegramBotHandler();
 
 // Webhook endpoint for Vercel
-app.post('/webhook', async (req, res) => {
+app.post('/webhook', parseUpdate, async (req, res) => {
   try {
-    console.log('Received webhook request:', JSON.stringify(req.body, null, 2));
+    // Acknowledge non-command updates (edits, reactions, joins, plain text)
+    // straight away; only slash commands need the bot and database
+    const message = req.body.message;
+    if (!message || typeof message.text !== 'string' || !message.text.startsWith('/')) {
+      res.status(200).type('json').send(WEBHOOK_OK_BODY);
+      return;
+    }
+    
+    // Make sure the database and bot are ready before handling the update;
+    // a no-op once the instance is warm. If that fails, answer with a 5xx so
+    // Telegram redelivers the update instead of dropping it.
+    try {
+      await initializeApp();
+    } catch (error) {
+      res.status(503).type('json').send(WEBHOOK_UNAVAILABLE_BODY);
+      return;
+    }
     
     // Handle the webhook update
     await telegramBot.handleWebhookUpdate(req.body);
     
     // Always respond with 200 OK to Telegram
-    res.status(200).json({ status: 'OK' });
+    res.status(200).type('json').send(WEBHOOK_OK_BODY);
   } catch (error) {
     console.error('Error handling webhook:', error);
     // Still respond with 200 to avoid Telegram retrying
-    res.status(200).json({ status: 'Error but OK' });
+    res.status(200).type('json').send(WEBHOOK_ERROR_BODY);
   }
 });
 
@@ -519,8 +477,13 @@ app.get('/', (req, res) => {
   });
 });
 
-// Initialize bot and database on startup
+// Initialize bot and database; both steps reuse their existing connection,
+// so this only does work on a cold start or after a failed attempt
 async function initializeApp() {
+  if (database.getConnectionStatus() && telegramBot.isInitialized) {
+    return;
+  }
+  
   try {
     // Connect to database first
     await database.connect();
@@ -531,12 +494,13 @@ async function initializeApp() {
     console.log('Bot initialized successfully');
   } catch (error) {
     console.error('Failed to initialize app:', error);
-    process.exit(1);
+    // Keep the instance alive; the next request retries initialization
+    throw error;
   }
 }
 
-// Initialize app
-initializeApp();
+// Start initializing on load so the first request finds it under way
+initializeApp().catch(() => {});
 
 // Export for Vercel
 module.exports = app;
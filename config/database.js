@@ -1,16 +1,35 @@
 const mongoose = require('mongoose');
 require('dotenv').config();
 
+const CONNECTION_OPTIONS = {
+    // A small pool is plenty for a webhook bot; keeping a socket open lets
+    // warm serverless invocations skip the TCP/TLS handshake.
+    maxPoolSize: 5,
+    minPoolSize: 1
+};
+
 class Database {
     constructor() {
         this.isConnected = false;
+        this.connectionPromise = null;
     }
 
-    async connect() {
-        try {
-            await mongoose.connect(process.env.MONGODB_URI, {
-                dbName: process.env.MONGODB_DB_NAME,
+    // Reuse a single connection for the lifetime of the process. Concurrent
+    // callers share the in-flight connection attempt instead of opening
+    // their own.
+    connect() {
+        if (!this.connectionPromise) {
+            this.connectionPromise = this.openConnection().catch((error) => {
+                this.connectionPromise = null;
+                throw error;
             });
+        }
+        return this.connectionPromise;
+    }
+
+    async openConnection() {
+        try {
+            await mongoose.connect(process.env.MONGODB_URI, this.getConnectionOptions());
 
             this.isConnected = true;
             console.log('Connected to MongoDB successfully with Mongoose');
@@ -25,6 +44,13 @@ class Database {
         }
     }
 
+    getConnectionOptions() {
+        return {
+            ...CONNECTION_OPTIONS,
+            dbName: process.env.MONGODB_DB_NAME,
+        };
+    }
+
     setupEventHandlers() {
         mongoose.connection.on('error', (error) => {
             console.error('MongoDB connection error:', error);
@@ -47,6 +73,7 @@ class Database {
             await mongoose.disconnect();
             console.log('Disconnected from MongoDB');
             this.isConnected = false;
+            this.connectionPromise = null;
         }
     }
 
@@ -1,5 +1,23 @@
 const mongoose = require('mongoose');
 
+// Matches trades saved without one of the fields every calculation relies on
+const CORRUPTED_TRADE_FILTER = {
+    $or: [
+        { total_shares: { $exists: false } },
+        { total_invested: { $exists: false } },
+        { average_buy_price: { $exists: false } },
+        { total_shares: null },
+        { total_invested: null },
+        { average_buy_price: null }
+    ]
+};
+
+// Sold totals with their schema default of 0 applied; lean reads and
+// pipeline updates bypass Mongoose defaults, so older trades saved without
+// these fields would otherwise turn sums and differences into null
+const SHARES_SOLD = { $ifNull: ['$total_shares_sold', 0] };
+const SOLD_VALUE = { $ifNull: ['$total_sold_value', 0] };
+
 const tradeSchema = new mongoose.Schema({
     ticker: {
         type: String,
@@ -49,7 +67,8 @@ const tradeSchema = new mongoose.Schema({
     timestamps: true
 });
 
-// Index is automatically created by unique: true on ticker field
+// Index is automatically created by unique: true on ticker field; it serves
+// both the findOne({ ticker }) lookups and the ticker-ordered listings.
 
 // Virtual for current holdings value
 tradeSchema.virtual('current_value').get(function() {
@@ -76,8 +95,131 @@ tradeSchema.statics.getOrCreateTrade = function(ticker) {
 };
 
 // Static method to get all trades
-tradeSchema.statics.getAllTrades = function() {
-    return this.find({}).sort({ ticker: 1 });
+// Returns plain objects (no virtuals) so read-only commands skip the
+// synchronous document hydration step on the event loop.
+tradeSchema.statics.getAllTrades = function({ skip = 0, limit = 0 } = {}) {
+    return this.find({}).sort({ ticker: 1 }).skip(skip).limit(limit).lean();
+};
+
+// Static method to get portfolio-wide totals
+// Sums are computed by the database, so the totals cover every trade even
+// when the caller only lists a page of them.
+tradeSchema.statics.getProfitTotals = async function() {
+    const [totals] = await this.aggregate([
+        {
+            $group: {
+                _id: null,
+                count: { $sum: 1 },
+                total_invested: { $sum: '$total_invested' },
+                total_sold_value: { $sum: SOLD_VALUE },
+                total_profit: {
+                    $sum: {
+                        $subtract: [
+                            SOLD_VALUE,
+                            { $multiply: [SHARES_SOLD, '$average_buy_price'] }
+                        ]
+                    }
+                }
+            }
+        }
+    ]);
+    return totals || { count: 0, total_invested: 0, total_sold_value: 0, total_profit: 0 };
+};
+
+// Static method to get trades that still have shares held
+// Filters server-side so only open positions cross the wire.
+tradeSchema.statics.getOpenTrades = function({ skip = 0, limit = 0 } = {}) {
+    return this.find({ $expr: { $gt: ['$total_shares', SHARES_SOLD] } })
+        .sort({ ticker: 1 })
+        .skip(skip)
+        .limit(limit)
+        .lean();
+};
+
+// Static method to record a purchase in a single atomic upsert
+// Creates the trade on first buy and folds later buys into the running
+// average. A trade missing one of its core fields is started afresh; one
+// holding NaN or negative shares/invested is left untouched and rejected.
+// Returns the trade after the purchase.
+tradeSchema.statics.recordBuy = async function(ticker, price, amount, shares) {
+    const isMissing = (field) => ({ $eq: [{ $type: field }, 'missing'] });
+    const isFresh = {
+        $or: [isMissing('$total_shares'), isMissing('$total_invested'), isMissing('$average_buy_price')]
+    };
+    // A null count is treated as zero, as the previous read-modify-write did
+    const currentShares = { $ifNull: ['$total_shares', 0] };
+    const currentInvested = { $ifNull: ['$total_invested', 0] };
+    const isValid = {
+        $and: [{ $gte: [currentShares, 0] }, { $gte: [currentInvested, 0] }]
+    };
+    const ifFresh = (fresh, existing) => ({ $cond: [isFresh, fresh, existing] });
+    const totalShares = { $add: [currentShares, shares] };
+    const totalInvested = { $add: [currentInvested, amount] };
+
+    try {
+        return await this.findOneAndUpdate(
+            { ticker, $expr: { $or: [isFresh, isValid] } },
+            [{
+                $set: {
+                    average_buy_price: ifFresh(price, { $divide: [totalInvested, totalShares] }),
+                    total_shares: ifFresh(shares, totalShares),
+                    total_invested: ifFresh(amount, totalInvested),
+                    total_sold_value: ifFresh(0, SOLD_VALUE),
+                    total_shares_sold: ifFresh(0, SHARES_SOLD),
+                    first_buy_date: ifFresh('$$NOW', '$first_buy_date'),
+                    last_buy_date: '$$NOW',
+                    last_sell_date: ifFresh(null, '$last_sell_date'),
+                    createdAt: { $ifNull: ['$createdAt', '$$NOW'] }
+                }
+            }],
+            { upsert: true, new: true }
+        ).lean();
+    } catch (error) {
+        // An existing trade that failed the filter makes the upsert collide
+        // with the unique ticker index
+        if (error.code === 11000) {
+            throw new Error('Invalid existing trade data: corrupted values detected');
+        }
+        throw error;
+    }
+};
+
+// Static method to record a sale in a single atomic update
+// Sells `shares` shares, or every remaining share when `shares` is null.
+// Returns the trade as it was before the sale, or null when the ticker has
+// no holdings or not enough remaining shares.
+tradeSchema.statics.sellShares = function(ticker, sellPrice, shares) {
+    const remainingShares = { $subtract: ['$total_shares', SHARES_SOLD] };
+    const filter = { ticker, total_shares: { $gt: 0 } };
+    let update;
+
+    if (shares === null) {
+        update = [{
+            $set: {
+                total_sold_value: { $add: [SOLD_VALUE, { $multiply: [remainingShares, sellPrice] }] },
+                total_shares_sold: '$total_shares',
+                last_sell_date: '$$NOW'
+            }
+        }];
+    } else {
+        filter.$expr = { $gte: [remainingShares, shares] };
+        update = {
+            $inc: { total_shares_sold: shares, total_sold_value: shares * sellPrice },
+            $set: { last_sell_date: new Date() }
+        };
+    }
+
+    return this.findOneAndUpdate(filter, update, { new: false }).lean();
+};
+
+// Static method to find trades with missing core fields
+tradeSchema.statics.findCorruptedTrades = function() {
+    return this.find(CORRUPTED_TRADE_FILTER).select('ticker').lean();
+};
+
+// Static method to delete trades with missing core fields
+tradeSchema.statics.deleteCorruptedTrades = function() {
+    return this.deleteMany(CORRUPTED_TRADE_FILTER);
 };
 
 module.exports = mongoose.model('Trade', tradeSchema);